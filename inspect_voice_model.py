@@ -34,9 +34,26 @@ except Exception:
     StandardScaler = None
 
 
+# Attributes through which sklearn meta-estimators reference nested estimators
+NESTED_ESTIMATOR_ATTRS = (
+    'named_steps', 'steps', 'transformers', 'estimators_', 'estimator',
+    'base_estimator', 'preprocessor', 'regressor', 'classifier', 'best_estimator_',
+)
+ESTIMATOR_MODULES = ('sklearn', 'imblearn')
+MAX_QUEUE_SIZE = 10000
+
+
+def _is_estimator_like(obj):
+    """True for objects defined in sklearn/imblearn (the only ones worth exploring)."""
+    module = getattr(type(obj), '__module__', '') or ''
+    return module.startswith(ESTIMATOR_MODULES)
+
+
 def find_scaler(obj):
     """Recursively search `obj` for any instance of StandardScaler.
     Uses a BFS/stack and tracks visited object ids to avoid infinite loops.
+    Only follows containers and the known meta-estimator attributes in
+    NESTED_ESTIMATOR_ATTRS; arrays, strings etc. are never enqueued.
     Returns True if found, False otherwise.
     """
     if StandardScaler is None:
@@ -85,18 +102,19 @@ def find_scaler(obj):
         # If it's a dict-like or list-like container, iterate elements
         try:
             if isinstance(current, dict):
-                for v in current.values():
-                    queue.append(v)
+                queue.extend(current.values())
                 continue
             if isinstance(current, (list, tuple, set)):
-                for v in current:
-                    queue.append(v)
+                queue.extend(current)
                 continue
         except Exception:
             pass
 
-        # Explore some common attributes that may contain transformers
-        for attr in ('named_steps', 'steps', 'transformers', 'estimators_', 'estimator', 'preprocessor'):
+        # Only sklearn/imblearn estimators can hold further transformers
+        if not _is_estimator_like(current):
+            continue
+
+        for attr in NESTED_ESTIMATOR_ATTRS:
             try:
                 val = getattr(current, attr, None)
                 if val is not None:
@@ -104,21 +122,9 @@ def find_scaler(obj):
             except Exception:
                 continue
 
-        # Last resort: inspect attributes (shallow)
-        try:
-            for name in dir(current):
-                if name.startswith('_'):
-                    continue
-                # avoid large or callable attributes
-                try:
-                    val = getattr(current, name)
-                except Exception:
-                    continue
-                if callable(val):
-                    continue
-                queue.append(val)
-        except Exception:
-            pass
+        if len(queue) > MAX_QUEUE_SIZE:
+            print(f"Warning: stopped scaler search after {MAX_QUEUE_SIZE} queued objects")
+            break
 
     return False
 
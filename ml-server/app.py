@@ -1,23 +1,59 @@
 # app.py
 """
 Single FastAPI ML inference server for:
- - MRI model (.h5)  -> POST /predict/mri
- - Voice model (scikit-learn SVC) -> POST /predict/voice
+ - MRI model (.h5 or exported .onnx/.tflite)  -> POST /predict/mri
+ - Voice model (scikit-learn SVC or exported .onnx/.npz) -> POST /predict/voice
 """
 
 import io
 import os
+import math
 import time
+import json
+import struct
+import hashlib
+import asyncio
 import logging
-from typing import Optional, List
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from typing import Optional, List, Callable, Any
+
+# Single-threaded BLAS per process, read when numpy/sklearn load it:
+# scale with workers, not with threads inside each worker
+os.environ.setdefault("OPENBLAS_NUM_THREADS", "1")
+os.environ.setdefault("MKL_NUM_THREADS", "1")
 
 import numpy as np
 import joblib
 import cv2
-import tensorflow as tf
+from PIL import Image, ImageOps
+from cachetools import LRUCache
 from fastapi import FastAPI, UploadFile, File, HTTPException, Request
-from fastapi.responses import JSONResponse
+from fastapi.responses import ORJSONResponse
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.middleware.gzip import GZipMiddleware
+
+try:
+    import onnxruntime as ort
+except ImportError:  # optional: MRI falls back to the Keras model
+    ort = None
+
+try:
+    import numba
+except ImportError:  # optional: the voice SVC runs through scikit-learn
+    numba = None
+
+try:
+    from turbojpeg import TurboJPEG, TJPF_RGB
+    _tj = TurboJPEG()
+except Exception:  # optional: package or libturbojpeg missing, JPEGs go through Pillow
+    _tj = None
+
+# A 128x128 resize is far cheaper than waking an OpenCV thread pool per
+# call; concurrency comes from the preprocessing pool and the workers
+cv2.setNumThreads(0)
+cv2.ocl.setUseOpenCL(False)
 
 # -------------------------
 # LOGGING SETUP
@@ -34,73 +70,524 @@ logger = logging.getLogger(__name__)
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 MODEL_DIR = os.path.join(BASE_DIR, "models")
 MRI_MODEL_PATH = os.path.join(MODEL_DIR, "model_bestmri.h5")
+MRI_FUSED_PATH = os.path.join(MODEL_DIR, "model_bestmri_fused.h5")
+MRI_ONNX_PATH = os.path.join(MODEL_DIR, "mri.onnx")
+MRI_ONNX_INT8_PATH = os.path.join(MODEL_DIR, "mri_int8.onnx")
+MRI_TFLITE_PATH = os.path.join(MODEL_DIR, "mri_int8.tflite")
+MRI_SAVEDMODEL_DIR = os.path.join(MODEL_DIR, "mri_saved")
+# auto | onnx | tflite | keras  (auto = first exported model found)
+MRI_BACKEND = os.environ.get("MRI_BACKEND", "auto").lower()
 VOICE_MODEL_PATH = os.path.join(MODEL_DIR, "voice_model.joblib")
+VOICE_ONNX_PATH = os.path.join(MODEL_DIR, "voice_model.onnx")
+VOICE_NPZ_PATH = os.path.join(MODEL_DIR, "voice_model.npz")
+# auto | onnx | npz | sklearn  (auto = ONNX export if present and onnxruntime
+# installed, then the .npz export if present, then the joblib SVC)
+VOICE_BACKEND = os.environ.get("VOICE_BACKEND", "auto").lower()
+# Compiled RBF-SVC predictor for the scikit-learn backend (needs numba)
+VOICE_NUMBA = os.environ.get("VOICE_NUMBA", "1") == "1"
 
 IMG_SIZE = (128, 128)
+# Decode + resize MRI uploads with TF ops (tf.io.decode_image) instead of
+# OpenCV/TurboJPEG. Only honoured for the TensorFlow backends (SavedModel,
+# Keras, TFLite), which already have TF imported.
+MRI_GRAPH_PREPROCESS = os.environ.get("MRI_GRAPH_PREPROCESS", "0") == "1"
+
+# Uploads larger than this are rejected with 413. Requests whose
+# Content-Length already exceeds it (plus multipart framing) are turned
+# away before the body is read at all.
+MAX_MRI_BYTES = int(float(os.environ.get("MAX_UPLOAD_SIZE_MB", "10")) * 1024 * 1024)
+MAX_REQUEST_BYTES = MAX_MRI_BYTES + 64 * 1024
 
 VOICE_LABELS = {0: "healthy", 1: "parkinsons"}
+VOICE_NUM_FEATURES = 22
 
 # -------------------------
-# FASTAPI + CORS
+# TENSORFLOW RUNTIME (LAZY)
 # -------------------------
-app = FastAPI(
-    title="Parkinsons-ML-Server",
-    version="2.0",
-    description="FastAPI ML inference server for Parkinson's disease prediction using MRI and voice data"
-)
+# TensorFlow is only imported when the Keras/TFLite MRI backend is loaded,
+# so workers serving MRI through ONNX Runtime never pay for / hold TF.
+# Small, fixed thread pools per process: several workers each spawning
+# cpu_count() TF threads just thrash the cores.
+TF_INTRA_OP_THREADS = int(os.environ.get("TF_NUM_INTRAOP_THREADS", "2"))
+TF_INTER_OP_THREADS = int(os.environ.get("TF_NUM_INTEROP_THREADS", "1"))
+TF_XLA_JIT = os.environ.get("TF_XLA_JIT", "1") == "1"
+# CPU-only by default: batch-1 inference doesn't amortize host<->GPU copies
+TF_USE_GPU = os.environ.get("TF_USE_GPU", "0") == "1"
 
-app.add_middleware(
-    CORSMiddleware,
-    allow_origins=["*"],  
-    allow_methods=["*"],
-    allow_headers=["*"],
-)
+tf = None
+
+def _import_tensorflow():
+    """Import and configure TensorFlow once, before any TF op runs."""
+    global tf
+    if tf is not None:
+        return tf
+
+    # Read by TensorFlow at import time
+    os.environ.setdefault("TF_CPP_MIN_LOG_LEVEL", "2")
+    os.environ.setdefault("TF_ENABLE_ONEDNN_OPTS", "1")   # oneDNN AVX2/AVX-512 fused convs
+    os.environ.setdefault("OMP_NUM_THREADS", str(TF_INTRA_OP_THREADS))
+    import tensorflow
+
+    if not TF_USE_GPU:
+        tensorflow.config.set_visible_devices([], "GPU")
+    tensorflow.config.threading.set_intra_op_parallelism_threads(TF_INTRA_OP_THREADS)
+    tensorflow.config.threading.set_inter_op_parallelism_threads(TF_INTER_OP_THREADS)
+    # XLA auto-clustering fuses the conv stack inside the traced tf.function
+    tensorflow.config.optimizer.set_jit(TF_XLA_JIT)
+    tf = tensorflow
+    return tf
 
 # -------------------------
-# LAZY MODEL LOADING
+# MODEL LOADING
 # -------------------------
 mri_model = None
+_mri_infer = None
+_mri_source: Optional[tuple] = None   # (backend, path) actually loaded
+_mri_load_lock = threading.Lock()
 voice_model = None
+_voice_infer = None
+_voice_source: Optional[tuple] = None
 _voice_has_proba = False
+_VOICE_CLASS_NAMES: tuple = ()   # label per probability column, in model order
+_mri_decode_graph = None   # traced tf.function(bytes) -> (1,128,128,3) when MRI_GRAPH_PREPROCESS
+
+def _xla_batch_sizes() -> List[int]:
+    """Powers of two up to MAX_BATCH_SIZE (inclusive): the shapes XLA compiles."""
+    sizes = [1]
+    while sizes[-1] < MAX_BATCH_SIZE:
+        sizes.append(min(sizes[-1] * 2, MAX_BATCH_SIZE))
+    return sizes
+
+def _build_keras_infer(model):
+    """
+    Wrap the Keras model in a traced tf.function so requests skip the
+    per-call overhead of model.predict() (callbacks, dataset wrapping).
+    """
+    spec = [tf.TensorSpec([None, IMG_SIZE[0], IMG_SIZE[1], 3], tf.float32)]
+
+    def make(jit_compile, warm_sizes):
+        @tf.function(input_signature=spec, jit_compile=jit_compile)
+        def infer(x):
+            return model(x, training=False)
+        # Trace (and XLA-compile) up front so no request pays for it
+        for n in warm_sizes:
+            infer(tf.zeros((n, IMG_SIZE[1], IMG_SIZE[0], 3), tf.float32))
+        return infer
+
+    if TF_XLA_JIT:
+        # Whole-model XLA compile: conv+bias+activation fused into single
+        # kernels. XLA compiles per input shape, so batches are padded up to
+        # one of a few sizes, all compiled here at startup.
+        try:
+            sizes = _xla_batch_sizes()
+            xla_infer = make(True, sizes)
+            logger.info(f"✅ MRI model compiled with XLA for batch sizes {sizes}")
+        except Exception as e:
+            logger.warning(f"XLA compile failed, using the regular TF graph: {e}")
+        else:
+            def run_padded(batch):
+                n = len(batch)
+                size = next((b for b in sizes if b >= n), n)
+                if size != n:
+                    padded = np.zeros((size,) + batch.shape[1:], np.float32)
+                    padded[:n] = batch
+                    batch = padded
+                return xla_infer(tf.constant(batch)).numpy()[:n]
+            return run_padded
+
+    infer = make(False, [1])
+    return lambda batch: infer(tf.constant(batch)).numpy()
+
+def _build_graph_preprocess():
+    """
+    Trace the decode + resize steps as a TF graph taking the raw upload bytes.
+    The model call itself stays in the dynamic batcher: one corrupt upload
+    then only fails its own request instead of the whole batch.
+    """
+    global _mri_decode_graph
+
+    @tf.function(input_signature=[tf.TensorSpec([], tf.string), tf.TensorSpec([], tf.int32)])
+    def decode(contents, orientation):
+        img = tf.io.decode_image(contents, channels=3, expand_animations=False)
+        # tf.io.decode_image ignores EXIF orientation: same transforms as
+        # _EXIF_TRANSPOSE, on the full-size image before the resize
+        img = tf.switch_case(orientation - 1, [
+            lambda: img,
+            lambda: img[:, ::-1],
+            lambda: img[::-1, ::-1],
+            lambda: img[::-1],
+            lambda: tf.transpose(img, [1, 0, 2]),
+            lambda: tf.image.rot90(img, k=3),
+            lambda: tf.transpose(img[::-1, ::-1], [1, 0, 2]),
+            lambda: tf.image.rot90(img, k=1),
+        ])
+        # "area" matches the INTER_AREA resize of the OpenCV path
+        img = tf.image.resize(img, (IMG_SIZE[1], IMG_SIZE[0]), method="area")
+        return img[tf.newaxis]
+
+    decode.get_concrete_function()
+    _mri_decode_graph = decode
+    logger.info("✅ MRI decode/resize running in the TF graph")
+
+def _load_savedmodel(path: str):
+    """
+    Serve the exported SavedModel through its serving_default concrete
+    function: one graph call per batch, no Keras predict() machinery.
+    """
+    _import_tensorflow()
+    loaded = tf.saved_model.load(path)
+    serve = loaded.signatures["serving_default"]
+
+    def infer(batch: np.ndarray) -> np.ndarray:
+        return serve(tf.constant(batch))["output_0"].numpy()
+
+    # Warm-up call so the first request doesn't pay graph initialization
+    infer(np.zeros((1, IMG_SIZE[0], IMG_SIZE[1], 3), np.float32))
+    return loaded, infer
+
+def _load_keras(path: str):
+    _import_tensorflow()
+    model = tf.keras.models.load_model(path)
+    return model, _build_keras_infer(model)
+
+def _load_onnx_session(path: str):
+    """Create an ONNX Runtime CPU session for an exported model."""
+    so = ort.SessionOptions()
+    # Same per-worker budget as TensorFlow: workers already cover the cores
+    so.intra_op_num_threads = TF_INTRA_OP_THREADS
+    so.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+    return ort.InferenceSession(path, sess_options=so, providers=["CPUExecutionProvider"])
+
+def _build_onnx_infer(session):
+    input_name = session.get_inputs()[0].name
+    return lambda batch: session.run(None, {input_name: batch})[0]
+
+def _load_onnx(path: str):
+    session = _load_onnx_session(path)
+    return session, _build_onnx_infer(session)
+
+def _build_tflite_infer(interpreter):
+    """
+    Batch-aware wrapper around a TFLite interpreter. Float pixel batches are
+    quantized with the model's input scale/zero-point (uint8 INT8 models),
+    and the input tensor is resized whenever the batch size changes.
+    The interpreter is not thread-safe, hence the lock.
+    """
+    lock = threading.Lock()
+    inp = interpreter.get_input_details()[0]
+    out = interpreter.get_output_details()[0]
+    in_scale, in_zero = inp["quantization"]
+    out_scale, out_zero = out["quantization"]
+
+    def infer(batch: np.ndarray) -> np.ndarray:
+        if in_scale:
+            info = np.iinfo(inp["dtype"])
+            batch = np.clip(np.rint(batch / in_scale + in_zero), info.min, info.max).astype(inp["dtype"])
+        with lock:
+            if interpreter.get_input_details()[0]["shape"][0] != len(batch):
+                interpreter.resize_tensor_input(inp["index"], list(batch.shape))
+                interpreter.allocate_tensors()
+            interpreter.set_tensor(inp["index"], batch)
+            interpreter.invoke()
+            preds = interpreter.get_tensor(out["index"])
+        if out_scale:
+            preds = (preds.astype(np.float32) - out_zero) * out_scale
+        return preds
+
+    return infer
+
+def _load_tflite(path: str):
+    _import_tensorflow()
+    # XNNPACK (int8/fp32 CPU kernels) is the default delegate in TF >= 2.3
+    interpreter = tf.lite.Interpreter(model_path=path, num_threads=TF_INTRA_OP_THREADS)
+    interpreter.allocate_tensors()
+    return interpreter, _build_tflite_infer(interpreter)
+
+_MRI_LOADERS = {
+    "onnx": _load_onnx,
+    "tflite": _load_tflite,
+    "savedmodel": _load_savedmodel,
+    "keras": _load_keras,
+}
+
+def _mri_candidates() -> List[tuple]:
+    """(backend, path) pairs in order of preference, honouring MRI_BACKEND."""
+    by_backend = {
+        "onnx": [("onnx", MRI_ONNX_INT8_PATH), ("onnx", MRI_ONNX_PATH)] if ort is not None else [],
+        "tflite": [("tflite", MRI_TFLITE_PATH)],
+        "keras": [("savedmodel", MRI_SAVEDMODEL_DIR), ("keras", MRI_FUSED_PATH), ("keras", MRI_MODEL_PATH)],
+    }
+    if MRI_BACKEND in by_backend:
+        return by_backend[MRI_BACKEND]
+    return by_backend["onnx"] + by_backend["tflite"] + by_backend["keras"]
 
 def load_mri_model():
-    """Lazy load MRI model with timing and error handling."""
-    global mri_model
+    """
+    Load the MRI model (once, at startup) with timing and error handling.
+    With MRI_BACKEND=auto, uses the first exported model that exists (see
+    export_models.py): ONNX INT8, ONNX FP32 (needs onnxruntime), TFLite INT8,
+    the TF SavedModel, then the Keras .h5 model (the normalization-fused
+    one if exported).
+    """
+    global mri_model, _mri_infer, _mri_source
     if mri_model is not None:
         return mri_model
-    
-    logger.info(f"Loading MRI model from {MRI_MODEL_PATH}...")
-    start_time = time.time()
-    
-    if not os.path.exists(MRI_MODEL_PATH):
-        logger.error(f"MRI model file not found at {MRI_MODEL_PATH}")
-        raise FileNotFoundError(f"MRI model not found at {MRI_MODEL_PATH}")
-    
-    try:
-        mri_model = tf.keras.models.load_model(MRI_MODEL_PATH)
-        load_time = time.time() - start_time
-        logger.info(f"✅ MRI model loaded successfully in {load_time:.2f}s")
-        return mri_model
-    except Exception as e:
-        logger.error(f"Failed to load MRI model: {e}")
-        raise
+
+    with _mri_load_lock:
+        if mri_model is not None:   # loaded by another thread meanwhile
+            return mri_model
+
+        candidates = _mri_candidates()
+        if not candidates:
+            raise RuntimeError(f"MRI_BACKEND={MRI_BACKEND} but onnxruntime is not installed")
+        backend, path = next(((b, p) for b, p in candidates if os.path.exists(p)), candidates[-1])
+
+        logger.info(f"Loading MRI model ({backend}) from {path}...")
+        start_time = time.time()
+
+        if not os.path.exists(path):
+            logger.error(f"MRI model file not found at {path}")
+            raise FileNotFoundError(f"MRI model not found at {path}")
+
+        try:
+            model, _mri_infer = _MRI_LOADERS[backend](path)
+            mri_model = model
+            _mri_source = (backend, path)
+            if MRI_GRAPH_PREPROCESS and backend != "onnx":
+                _build_graph_preprocess()
+            load_time = time.time() - start_time
+            logger.info(f"✅ MRI model loaded successfully in {load_time:.2f}s")
+            return mri_model
+        except Exception as e:
+            logger.error(f"Failed to load MRI model: {e}")
+            raise
+
+# -------------------------
+# VOICE SVC KERNEL (NUMBA)
+# -------------------------
+# A binary RBF SVC reduces to
+#   df = sum_i dual_coef_[i] * exp(-gamma * |x - sv_i|^2) + intercept_
+# predict() is classes_[1] if df >= 0 else classes_[0]. With
+# probability=True, predict_proba feeds libsvm's Platt estimate
+#   r = 1 / (1 + exp(-df * probA_ + probB_))
+# through its multiclass_probability solver, which scikit-learn's bundled
+# libsvm also runs for two classes. Compiled once, this skips sklearn's
+# per-call validation and dispatch.
+def _svc_rbf_decision(X, sv, dc, gamma, intercept):
+    out = np.empty(X.shape[0], dtype=np.float64)
+    for r in range(X.shape[0]):
+        acc = 0.0
+        for i in range(sv.shape[0]):
+            d = 0.0
+            for j in range(sv.shape[1]):
+                t = X[r, j] - sv[i, j]
+                d += t * t
+            acc += dc[i] * math.exp(-gamma * d)
+        out[r] = acc + intercept
+    return out
+
+def _svc_binary_proba(df, prob_a, prob_b):
+    out = np.empty((df.shape[0], 2), dtype=np.float64)
+    for r in range(df.shape[0]):
+        # sigmoid_predict(): libsvm's decision value is -df
+        f = -df[r] * prob_a + prob_b
+        pr = math.exp(-f) / (1.0 + math.exp(-f)) if f >= 0.0 else 1.0 / (1.0 + math.exp(f))
+        pr = min(max(pr, 1e-7), 1.0 - 1e-7)
+        # multiclass_probability() for k=2: Q = [[q^2, -qr], [-qr, r^2]],
+        # p starts at 1/2, eps = 0.005 / k, at most 100 iterations
+        q = 1.0 - pr
+        q00 = q * q
+        q11 = pr * pr
+        q01 = -q * pr
+        p0 = 0.5
+        p1 = 0.5
+        for _ in range(100):
+            qp0 = q00 * p0 + q01 * p1
+            qp1 = q01 * p0 + q11 * p1
+            pqp = p0 * qp0 + p1 * qp1
+            if max(abs(qp0 - pqp), abs(qp1 - pqp)) < 0.0025:
+                break
+            diff = (pqp - qp0) / q00
+            p0 += diff
+            pqp = (pqp + diff * (diff * q00 + 2.0 * qp0)) / (1.0 + diff) / (1.0 + diff)
+            qp0 = (qp0 + diff * q00) / (1.0 + diff)
+            qp1 = (qp1 + diff * q01) / (1.0 + diff)
+            p0 /= 1.0 + diff
+            p1 /= 1.0 + diff
+            diff = (pqp - qp1) / q11
+            p1 += diff
+            pqp = (pqp + diff * (diff * q11 + 2.0 * qp1)) / (1.0 + diff) / (1.0 + diff)
+            qp0 = (qp0 + diff * q01) / (1.0 + diff)
+            qp1 = (qp1 + diff * q11) / (1.0 + diff)
+            p0 /= 1.0 + diff
+            p1 /= 1.0 + diff
+        out[r, 0] = p0
+        out[r, 1] = p1
+    return out
+
+if numba is not None:
+    _svc_rbf_decision = numba.njit(cache=True, fastmath=True)(_svc_rbf_decision)
+    _svc_binary_proba = numba.njit(cache=True)(_svc_binary_proba)
+else:
+    def _svc_rbf_decision(X, sv, dc, gamma, intercept):
+        """Vectorized numpy version of the kernel sum, for when numba is missing."""
+        d = ((X[:, np.newaxis, :].astype(np.float64) - sv[np.newaxis]) ** 2).sum(axis=2)
+        return np.exp(-gamma * d) @ dc + intercept
+
+def _svc_rbf_params(model) -> Optional[dict]:
+    """Arrays the compiled predictor needs, or None if the model isn't a supported SVC."""
+    if (getattr(model, "kernel", None) != "rbf" or getattr(model, "_sparse", True)
+            or len(getattr(model, "classes_", ())) != 2):
+        return None
+    params = {
+        # float64 like libsvm; no copy for the (mmapped) float64 arrays
+        "sv": np.ascontiguousarray(model.support_vectors_, dtype=np.float64),
+        "dc": np.ascontiguousarray(model.dual_coef_[0], dtype=np.float64),
+        "gamma": float(model._gamma),
+        "intercept": float(model.intercept_[0]),
+        "classes": np.asarray(model.classes_.tolist()),
+    }
+    if getattr(model, "probability", False):
+        params["prob_a"] = float(model.probA_[0])
+        params["prob_b"] = float(model.probB_[0])
+    return params
+
+def _build_svc_rbf_infer(params: dict) -> Callable:
+    """Probability rows when the SVC has Platt parameters, else predicted labels."""
+    def decision(batch):
+        return _svc_rbf_decision(batch, params["sv"], params["dc"], params["gamma"], params["intercept"])
+
+    if "prob_a" in params:
+        return lambda batch: _svc_binary_proba(decision(batch), params["prob_a"], params["prob_b"])
+    classes = params["classes"]
+    return lambda batch: classes[(decision(batch) >= 0.0).astype(np.intp)]
+
+def _svc_rbf_error(model, params: dict, infer: Callable, sample: np.ndarray) -> float:
+    """Largest deviation of `infer` from scikit-learn on `sample` (inf on a label mismatch)."""
+    if "prob_a" in params:
+        return float(np.abs(infer(sample) - model.predict_proba(sample)).max())
+    if not np.array_equal(infer(sample), model.predict(sample)):
+        return float("inf")
+    df = _svc_rbf_decision(sample, params["sv"], params["dc"], params["gamma"], params["intercept"])
+    return float(np.abs(df - model.decision_function(sample)).max())
+
+# Compiled predictor must match scikit-learn this closely to be used
+SVC_KERNEL_TOLERANCE = 1e-6
+
+def _load_voice_sklearn(path: str):
+    # mmap the SVC arrays (support vectors etc.) read-only: workers forked
+    # after a preload share the same physical pages instead of copying them
+    model = joblib.load(path, mmap_mode="r")
+    # ...except what libsvm's predict_proba takes as writable buffers (it
+    # raises "buffer source array is read-only" otherwise): the Platt
+    # parameters, intercepts and dual coefficients. The support vectors,
+    # by far the largest array, stay shared.
+    for est in [model] + [step for _, step in getattr(model, "steps", [])]:
+        for attr in ("_probA", "_probB", "_intercept_", "_dual_coef_"):
+            if isinstance(getattr(est, attr, None), np.ndarray):
+                setattr(est, attr, np.array(getattr(est, attr)))
+    has_proba = hasattr(model, "predict_proba")
+    infer = model.predict_proba if has_proba else model.predict
+
+    params = _svc_rbf_params(model) if numba is not None and VOICE_NUMBA else None
+    if params is not None:
+        try:
+            fast_infer = _build_svc_rbf_infer(params)
+            # Compile now and check against scikit-learn on real samples
+            sample = np.asarray(params["sv"][:64], dtype=np.float32)
+            err = _svc_rbf_error(model, params, fast_infer, sample)
+            if err <= SVC_KERNEL_TOLERANCE:
+                infer = fast_infer
+                logger.info(f"✅ Voice SVC compiled with numba (max diff vs sklearn {err:.1e})")
+            else:
+                logger.warning(f"Numba SVC predictor disagrees with sklearn (max diff {err:.1e}), not using it")
+        except Exception as e:
+            logger.warning(f"Numba SVC predictor unavailable, using sklearn: {e}")
+    return model, infer, (model.classes_ if has_proba else None)
+
+def _load_voice_npz(path):
+    """
+    The SVC as plain arrays (export_models.py voice-npz): no sklearn object
+    graph to unpickle at startup. .npz members can't be memory-mapped, but
+    they are only a few KB. Predicts probabilities when the export has the
+    Platt parameters, else labels.
+    """
+    with np.load(path, allow_pickle=False) as data:
+        params = {
+            "sv": np.ascontiguousarray(data["sv"], dtype=np.float64),
+            "dc": np.ascontiguousarray(data["dc"], dtype=np.float64),
+            "gamma": float(data["gamma"]),
+            "intercept": float(data["intercept"]),
+            "classes": data["classes"],
+        }
+        if "prob_a" in data.files:
+            params["prob_a"] = float(data["prob_a"])
+            params["prob_b"] = float(data["prob_b"])
+    classes = params["classes"] if "prob_a" in params else None
+    return params, _build_svc_rbf_infer(params), classes
+
+def _load_voice_onnx(path: str):
+    """
+    ONNX Runtime session for the skl2onnx-exported SVC. One intra-op thread:
+    the 22-feature math is trivial, concurrency comes from workers/batches.
+    Outputs are (label, scores); the scores are only probabilities when the
+    export says so in its metadata (otherwise they are decision values and
+    just the label is used).
+    """
+    so = ort.SessionOptions()
+    so.intra_op_num_threads = 1
+    session = ort.InferenceSession(path, sess_options=so, providers=["CPUExecutionProvider"])
+    input_name = session.get_inputs()[0].name
+    label_name, prob_name = (o.name for o in session.get_outputs()[:2])
+    meta = session.get_modelmeta().custom_metadata_map
+    if meta.get("probabilities") != "1":
+        logger.warning(f"{path} has no exported probabilities, serving labels only")
+        return session, lambda batch: session.run([label_name], {input_name: batch})[0], None
+    classes = np.array(json.loads(meta["classes"]))
+    return session, lambda batch: session.run([prob_name], {input_name: batch})[0], classes
+
+def _voice_backend() -> tuple:
+    """(backend, path) for the voice model, honouring VOICE_BACKEND."""
+    onnx_ok = ort is not None and os.path.exists(VOICE_ONNX_PATH)
+    if VOICE_BACKEND == "onnx" or (VOICE_BACKEND == "auto" and onnx_ok):
+        return "onnx", VOICE_ONNX_PATH
+    if VOICE_BACKEND == "npz" or (VOICE_BACKEND == "auto" and os.path.exists(VOICE_NPZ_PATH)):
+        return "npz", VOICE_NPZ_PATH
+    return "sklearn", VOICE_MODEL_PATH
 
 def load_voice_model():
-    """Lazy load Voice model with timing and error handling."""
-    global voice_model, _voice_has_proba
+    """
+    Load the Voice model (once, at startup) with timing and error handling.
+    Uses the skl2onnx export (see export_models.py) through ONNX Runtime
+    when available, then the .npz array export, otherwise the
+    joblib-pickled scikit-learn SVC.
+    """
+    global voice_model, _voice_infer, _voice_source, _voice_has_proba, _VOICE_CLASS_NAMES
     if voice_model is not None:
         return voice_model
-    
-    logger.info(f"Loading Voice model from {VOICE_MODEL_PATH}...")
+
+    backend, path = _voice_backend()
+    logger.info(f"Loading Voice model ({backend}) from {path}...")
     start_time = time.time()
     
-    if not os.path.exists(VOICE_MODEL_PATH):
-        logger.error(f"Voice model file not found at {VOICE_MODEL_PATH}")
-        raise FileNotFoundError(f"Voice model not found at {VOICE_MODEL_PATH}")
+    if not os.path.exists(path):
+        logger.error(f"Voice model file not found at {path}")
+        raise FileNotFoundError(f"Voice model not found at {path}")
     
     try:
-        voice_model = joblib.load(VOICE_MODEL_PATH)
-        _voice_has_proba = hasattr(voice_model, "predict_proba")
+        if backend == "onnx":
+            model, infer, classes = _load_voice_onnx(path)
+        elif backend == "npz":
+            model, infer, classes = _load_voice_npz(path)
+        else:
+            model, infer, classes = _load_voice_sklearn(path)
+        _voice_infer = infer
+        _voice_has_proba = classes is not None
+        if _voice_has_proba:
+            # Resolved once here so requests never touch classes_ / VOICE_LABELS
+            _VOICE_CLASS_NAMES = tuple(VOICE_LABELS.get(c, str(c)) for c in np.asarray(classes).tolist())
+        voice_model = model
+        _voice_source = (backend, path)
         load_time = time.time() - start_time
         logger.info(f"✅ Voice model loaded successfully in {load_time:.2f}s")
         return voice_model
@@ -108,58 +595,580 @@ def load_voice_model():
         logger.error(f"Failed to load Voice model: {e}")
         raise
 
+def load_models():
+    """
+    Load both models and push one dummy input through each, so graph
+    tracing / kernel selection happens before traffic arrives. A model that
+    fails to load or to run the warm-up input is logged, left unset, and
+    its endpoint answers 503.
+    """
+    global mri_model, _mri_infer, _mri_source, voice_model, _voice_infer, _voice_source
+    try:
+        load_mri_model()
+        _mri_infer(np.zeros((1, IMG_SIZE[1], IMG_SIZE[0], 3), np.float32))
+    except Exception as e:
+        logger.error(f"MRI model unavailable: {e}")
+        mri_model, _mri_infer, _mri_source = None, None, None
+
+    try:
+        load_voice_model()
+        _voice_infer(np.zeros((1, VOICE_NUM_FEATURES), np.float32))
+    except Exception as e:
+        logger.error(f"Voice model unavailable: {e}")
+        voice_model, _voice_infer, _voice_source = None, None, None
+
+# -------------------------
+# DYNAMIC BATCHING
+# -------------------------
+# Up to MAX_BATCH requests arriving within BATCH_WINDOW seconds of the first
+# share one forward pass. MAX_BATCH=1 turns batching off.
+MAX_BATCH_SIZE = max(1, int(os.environ.get("MAX_BATCH", "16")))
+MAX_BATCH_DELAY = float(os.environ.get("BATCH_WINDOW", "0.02"))  # seconds
+# Threads running the batched model calls off the event loop. Each batcher
+# runs one batch at a time, so 2 lets an MRI and a voice batch overlap.
+INFER_THREADS = max(1, int(os.environ.get("INFER_THREADS", "2")))
+
+class DynBatcher:
+    """
+    Fuses concurrent single-sample requests into one batched model call.
+      - each request is queued together with a Future
+      - the worker collects up to `max_batch_size` items, waiting at most
+        `max_delay` seconds after the first one arrives
+      - `infer_fn` receives the list of inputs and returns one output per input;
+        it runs on `executor` so the event loop keeps serving other requests
+        (new arrivals queue up for the next batch meanwhile)
+    """
+
+    def __init__(self, infer_fn: Callable[[List[Any]], List[Any]], executor: Optional[ThreadPoolExecutor] = None,
+                 max_batch_size: int = MAX_BATCH_SIZE, max_delay: float = MAX_BATCH_DELAY):
+        self.infer_fn = infer_fn
+        self.executor = executor
+        self.max_batch_size = max_batch_size
+        self.max_delay = max_delay
+        self._queue: Optional[asyncio.Queue] = None
+        self._worker: Optional[asyncio.Task] = None
+
+    def start(self):
+        self._queue = asyncio.Queue()
+        self._worker = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._worker is None:
+            return
+        self._worker.cancel()
+        try:
+            await self._worker
+        except asyncio.CancelledError:
+            pass
+        self._worker = None
+
+    async def process_batched(self, x: Any) -> Any:
+        """Queue one input and wait for its slice of the batched result."""
+        fut = asyncio.get_running_loop().create_future()
+        await self._queue.put((x, fut))
+        return await fut
+
+    async def _collect(self) -> list:
+        loop = asyncio.get_running_loop()
+        items = [await self._queue.get()]
+        deadline = loop.time() + self.max_delay
+        while len(items) < self.max_batch_size:
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            try:
+                items.append(await asyncio.wait_for(self._queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        return items
+
+    async def _run(self):
+        while True:
+            items = await self._collect()
+            # Skip requests whose client already went away
+            items = [(x, fut) for x, fut in items if not fut.done()]
+            if not items:
+                continue
+
+            try:
+                outputs = await asyncio.get_running_loop().run_in_executor(
+                    self.executor, self.infer_fn, [x for x, _ in items]
+                )
+            except Exception as e:
+                logger.error(f"Batched inference failed ({len(items)} items): {e}")
+                for _, fut in items:
+                    if not fut.done():
+                        fut.set_exception(e)
+                continue
+
+            for (_, fut), out in zip(items, outputs):
+                if not fut.done():
+                    fut.set_result(out)
+
+# Float32 model input, allocated once and filled in place for every batch.
+# The lock keeps two inference threads from writing into it at once.
+# This is the only reusable buffer on the MRI path: each request's small
+# uint8 (1,128,128,3) decode stays its own array, because it waits in the
+# batch queue (and may be cached) while the preprocessing thread that made
+# it is already decoding the next upload.
+_MRI_BATCH_BUF = np.empty((MAX_BATCH_SIZE, IMG_SIZE[1], IMG_SIZE[0], 3), dtype=np.float32)
+_MRI_BATCH_BUF_LOCK = threading.Lock()
+
+def _mri_infer_batch(images: List[np.ndarray]) -> List[np.ndarray]:
+    """Run one MRI forward pass over a list of uint8 (1,128,128,3) inputs."""
+    n = len(images)
+    if n > len(_MRI_BATCH_BUF):
+        # Oversized batch (custom batcher config): no shared buffer to reuse
+        return list(_mri_infer(np.concatenate(images, axis=0).astype(np.float32)))
+
+    with _MRI_BATCH_BUF_LOCK:
+        batch = _MRI_BATCH_BUF[:n]
+        for i, img in enumerate(images):
+            batch[i] = img[0]   # uint8 -> float32 in one pass, no temporary
+        preds = _mri_infer(batch)
+    return list(preds)
+
+def _voice_infer_batch(arrs: List[np.ndarray]) -> list:
+    """
+    Run one voice model pass over a list of (1,22) inputs.
+    Returns a probability row per input when the model provides
+    probabilities (the label is derived from it), else the predicted class.
+    """
+    batch = np.vstack(arrs)
+    return list(_voice_infer(batch))
+
+mri_batcher: Optional[DynBatcher] = None
+voice_batcher: Optional[DynBatcher] = None
+
+# Decoding/parsing uploads runs here so it doesn't block the event loop.
+# OpenCV and numpy release the GIL, so decodes overlap across threads.
+_preproc_pool: Optional[ThreadPoolExecutor] = None
+
+async def run_preprocess(fn: Callable, *args) -> Any:
+    """Run a synchronous preprocessing function on the preprocessing pool."""
+    return await asyncio.get_running_loop().run_in_executor(_preproc_pool, fn, *args)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """
+    Load and warm up both models before accepting traffic, then start one
+    batcher per model and the preprocessing pool for the server's lifetime.
+    """
+    global mri_batcher, voice_batcher, _preproc_pool
+    load_models()
+    _preproc_pool = ThreadPoolExecutor(max_workers=os.cpu_count(), thread_name_prefix="preproc")
+    app.state.executor = ThreadPoolExecutor(max_workers=INFER_THREADS, thread_name_prefix="infer")
+    mri_batcher = DynBatcher(_mri_infer_batch, app.state.executor)
+    voice_batcher = DynBatcher(_voice_infer_batch, app.state.executor)
+    mri_batcher.start()
+    voice_batcher.start()
+    try:
+        yield
+    finally:
+        await mri_batcher.stop()
+        await voice_batcher.stop()
+        _preproc_pool.shutdown(wait=False)
+        app.state.executor.shutdown(wait=False)
+
+# -------------------------
+# PREDICTION CACHE
+# -------------------------
+# Identical re-uploads (demos, client retries) skip inference entirely.
+# MRI entries are keyed by a hash of the raw upload, voice entries by the
+# 88 bytes of the float32 feature vector. Caches are per worker process.
+PREDICTION_CACHE_SIZE = 1024
+
+_mri_cache = LRUCache(maxsize=PREDICTION_CACHE_SIZE)
+_voice_cache = LRUCache(maxsize=PREDICTION_CACHE_SIZE)
+_cache_lock = threading.Lock()
+
+def cache_key(data: bytes) -> bytes:
+    return hashlib.blake2b(data, digest_size=16).digest()
+
+def cache_get(cache: LRUCache, key: bytes) -> Optional[tuple]:
+    with _cache_lock:
+        return cache.get(key)
+
+def cache_put(cache: LRUCache, key: bytes, value: tuple):
+    with _cache_lock:
+        cache[key] = value
+
+# -------------------------
+# FASTAPI + CORS
+# -------------------------
+app = FastAPI(
+    title="Parkinsons-ML-Server",
+    version="2.0",
+    description="FastAPI ML inference server for Parkinson's disease prediction using MRI and voice data",
+    lifespan=lifespan,
+    default_response_class=ORJSONResponse
+)
+
+class RejectOversizedRequests:
+    """
+    413 from the Content-Length header, before the body is received.
+    Plain ASGI rather than @app.middleware("http") (BaseHTTPMiddleware):
+    every other request passes straight through, without an extra task
+    and stream round trip just to read one header.
+    """
+
+    def __init__(self, app, max_bytes: int):
+        self.app = app
+        self.max_bytes = max_bytes
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http":
+            for name, value in scope["headers"]:
+                if name == b"content-length":
+                    if value.isdigit() and int(value) > self.max_bytes:
+                        response = ORJSONResponse(
+                            status_code=413,
+                            content={"detail": f"Request too large. Maximum upload size is {MAX_MRI_BYTES // (1024 * 1024)} MB"}
+                        )
+                        await response(scope, receive, send)
+                        return
+                    break
+        await self.app(scope, receive, send)
+
+app.add_middleware(RejectOversizedRequests, max_bytes=MAX_REQUEST_BYTES)
+
+# Prediction replies are a few hundred bytes; only compress larger ones
+app.add_middleware(GZipMiddleware, minimum_size=1024)
+
+# Added last so CORS headers are also set on the 413 above
+app.add_middleware(
+    CORSMiddleware,
+    allow_origins=["*"],  
+    allow_methods=["*"],
+    allow_headers=["*"],
+)
+
 # -------------------------
 # MRI PREPROCESSING (NEW)
 # -------------------------
+JPEG_MAGIC = b"\xff\xd8\xff"
+PNG_MAGIC = b"\x89PNG\r\n\x1a\n"
+# Formats OpenCV can decode; anything else is rejected before decoding
+_IMAGE_MAGICS = (
+    (JPEG_MAGIC, "jpeg"),
+    (PNG_MAGIC, "png"),
+    (b"RIFF", "webp"),   # + b"WEBP" at offset 8, checked below
+    (b"BM", "bmp"),
+    (b"II*\x00", "tiff"),
+    (b"MM\x00*", "tiff"),
+)
+_JPEG_SCALES = ((1, 8), (1, 4), (1, 2))
+_CV2_REDUCED_FLAGS = (
+    (8, cv2.IMREAD_REDUCED_COLOR_8),
+    (4, cv2.IMREAD_REDUCED_COLOR_4),
+    (2, cv2.IMREAD_REDUCED_COLOR_2),
+)
+
+# EXIF orientation (2-8) -> transform that displays the image upright, as
+# cv2.imdecode(IMREAD_COLOR) and PIL.ImageOps.exif_transpose apply it
+_EXIF_TRANSPOSE = {
+    2: lambda img: img[:, ::-1],
+    3: lambda img: img[::-1, ::-1],
+    4: lambda img: img[::-1],
+    5: lambda img: img.transpose(1, 0, 2),
+    6: lambda img: np.rot90(img, -1),
+    7: lambda img: img[::-1, ::-1].transpose(1, 0, 2),
+    8: lambda img: np.rot90(img),
+}
+
+def _jpeg_exif_orientation(img_bytes: bytes) -> int:
+    """
+    EXIF orientation tag of a JPEG (1 if absent or unreadable). Only the
+    marker segments before the image data are walked, nothing is decoded.
+    """
+    pos = 2
+    while pos + 4 <= len(img_bytes) and img_bytes[pos] == 0xFF:
+        marker = img_bytes[pos + 1]
+        if marker == 0xFF:   # fill byte
+            pos += 1
+            continue
+        if marker == 0xDA:   # start of scan: no metadata past this point
+            break
+        seg_len = struct.unpack(">H", img_bytes[pos + 2:pos + 4])[0]
+        if marker == 0xE1 and img_bytes[pos + 4:pos + 10] == b"Exif\x00\x00":
+            tiff = img_bytes[pos + 10:pos + 2 + seg_len]
+            endian = {b"II": "<", b"MM": ">"}.get(tiff[:2])
+            if endian is None or len(tiff) < 8:
+                return 1
+            ifd = struct.unpack(endian + "I", tiff[4:8])[0]
+            if ifd + 2 > len(tiff):
+                return 1
+            for i in range(struct.unpack(endian + "H", tiff[ifd:ifd + 2])[0]):
+                entry = ifd + 2 + 12 * i
+                if entry + 12 > len(tiff):
+                    break
+                if struct.unpack(endian + "H", tiff[entry:entry + 2])[0] == 0x0112:
+                    value = struct.unpack(endian + "H", tiff[entry + 8:entry + 10])[0]
+                    return value if value in _EXIF_TRANSPOSE else 1
+            return 1
+        pos += 2 + seg_len
+    return 1
+
+def _decode_jpeg_turbo(img_bytes: bytes) -> np.ndarray:
+    """
+    Decode a JPEG with libjpeg-turbo straight to RGB, using the largest
+    DCT-domain downscale that still leaves both sides >= 128 px, then apply
+    the EXIF orientation (libjpeg-turbo ignores it; phone photos need it).
+    """
+    width, height = _tj.decode_header(img_bytes)[:2]
+    scale = next(
+        (s for s in _JPEG_SCALES
+         if width * s[0] // s[1] >= IMG_SIZE[0] and height * s[0] // s[1] >= IMG_SIZE[1]),
+        (1, 1)
+    )
+    img = _tj.decode(img_bytes, pixel_format=TJPF_RGB, scaling_factor=scale)
+    orientation = _jpeg_exif_orientation(img_bytes)
+    if orientation != 1:
+        img = np.ascontiguousarray(_EXIF_TRANSPOSE[orientation](img))
+    return img
+
+def _decode_jpeg_pillow(img_bytes: bytes) -> np.ndarray:
+    """
+    Fallback without libturbojpeg: Pillow's draft() also makes libjpeg
+    scale in the DCT domain, to the smallest size that is still >= 128 px.
+    The EXIF orientation is applied like cv2.imdecode does.
+    """
+    img = Image.open(io.BytesIO(img_bytes))
+    img.draft("RGB", IMG_SIZE)
+    img = ImageOps.exif_transpose(img)
+    return np.asarray(img.convert("RGB"))
+
+def _reduced_decode_flag(width: int, height: int) -> int:
+    """Largest OpenCV IMREAD_REDUCED_COLOR_* factor keeping both sides >= 128 px."""
+    return next(
+        (flag for f, flag in _CV2_REDUCED_FLAGS if width // f >= IMG_SIZE[0] and height // f >= IMG_SIZE[1]),
+        cv2.IMREAD_COLOR
+    )
+
+def sniff_image_format(img_bytes: bytes) -> str:
+    """
+    Identify the upload from its magic bytes, so garbage is turned away
+    before OpenCV parses it or allocates a decode buffer.
+    """
+    for magic, fmt in _IMAGE_MAGICS:
+        if img_bytes.startswith(magic):
+            if fmt == "webp" and img_bytes[8:12] != b"WEBP":
+                break
+            return fmt
+    raise ValueError("Invalid image: unsupported or unrecognized format")
+
 def preprocess_mri_from_bytes(img_bytes: bytes) -> np.ndarray:
     """
     NEW CORRECT PREPROCESS:
-      - decode image
-      - convert to BGR → RGB
-      - resize to 128x128
+      - reject anything that isn't JPEG/PNG/WEBP/BMP/TIFF by magic bytes
+      - JPEG: DCT-domain downscaled decode directly to RGB
+        (PyTurboJPEG if available, else Pillow draft mode)
+      - PNG: OpenCV reduced decode (1/2, 1/4, 1/8) picked from the IHDR size
+      - other formats: decode at half resolution (IMREAD_REDUCED_COLOR_2)
+      - resize to 128x128 (INTER_AREA, we are always downscaling)
+      - convert to BGR → RGB on the small 128x128 buffer (OpenCV path)
       - DO NOT NORMALIZE (model has preprocessing inside)
-      - return float32 (1,128,128,3)
+      - return uint8 (1,128,128,3); the MRI batcher casts to float32
+        into its preallocated input buffer
     """
+    fmt = sniff_image_format(img_bytes)
+    if fmt == "jpeg":
+        try:
+            img_rgb = _decode_jpeg_turbo(img_bytes) if _tj is not None else _decode_jpeg_pillow(img_bytes)
+            return cv2.resize(img_rgb, IMG_SIZE, interpolation=cv2.INTER_AREA)[np.newaxis]
+        except Exception:
+            pass  # corrupt/unsupported JPEG: let OpenCV decide
+
     nparr = np.frombuffer(img_bytes, np.uint8)
-    img_bgr = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
+    if fmt == "png" and len(img_bytes) >= 24:
+        width, height = struct.unpack(">II", img_bytes[16:24])
+        img_bgr = cv2.imdecode(nparr, _reduced_decode_flag(width, height))
+    else:
+        img_bgr = cv2.imdecode(nparr, cv2.IMREAD_REDUCED_COLOR_2)
+        if img_bgr is not None and (img_bgr.shape[1] < IMG_SIZE[0] or img_bgr.shape[0] < IMG_SIZE[1]):
+            # Small source image: decode at full size rather than upscale a half-size one
+            img_bgr = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
     if img_bgr is None:
         raise ValueError("Invalid image")
 
-    img_rgb = cv2.cvtColor(img_bgr, cv2.COLOR_BGR2RGB)
-    img_resized = cv2.resize(img_rgb, IMG_SIZE)
+    img_resized = cv2.resize(img_bgr, IMG_SIZE, interpolation=cv2.INTER_AREA)
+    img_rgb = cv2.cvtColor(img_resized, cv2.COLOR_BGR2RGB)
+
+    return img_rgb[np.newaxis]   # (1,128,128,3)
 
-    img_f = img_resized.astype(np.float32)
-    img_batch = np.expand_dims(img_f, axis=0)   # (1,128,128,3)
+# Formats tf.io.decode_image handles (of those sniff_image_format accepts)
+_TF_DECODABLE_FORMATS = ("jpeg", "png", "bmp")
 
-    return img_batch
+def preprocess_mri_in_graph(img_bytes: bytes) -> np.ndarray:
+    """
+    Same contract as preprocess_mri_from_bytes (RGB, 128x128, not
+    normalized) but decoded and resized by the traced TF graph; returns
+    float32 (1,128,128,3). Formats TF can't decode (TIFF, WEBP) go
+    through preprocess_mri_from_bytes instead.
+    """
+    fmt = sniff_image_format(img_bytes)
+    if fmt not in _TF_DECODABLE_FORMATS:
+        return preprocess_mri_from_bytes(img_bytes)
+    orientation = _jpeg_exif_orientation(img_bytes) if fmt == "jpeg" else 1
+    try:
+        return _mri_decode_graph(tf.constant(img_bytes), tf.constant(orientation, tf.int32)).numpy()
+    except tf.errors.InvalidArgumentError:
+        raise ValueError("Invalid image")
 
 # -------------------------
 # VOICE PREPROCESSING
 # -------------------------
-def preprocess_voice_from_npy_bytes(npy_bytes: bytes) -> np.ndarray:
+def _feature_count_error(n: int) -> ValueError:
+    return ValueError(
+        f"Expected {VOICE_NUM_FEATURES} features, got {n}. "
+        "Please provide all required voice measurements."
+    )
+
+def _require_finite(arr: np.ndarray) -> np.ndarray:
+    """
+    Reject NaN/Inf (and values that overflowed float32): the backends
+    would still return a confident label for them.
+    """
+    if not np.isfinite(arr).all():
+        raise ValueError("Features must be finite numbers (no NaN or Infinity, |x| < 3.4e38)")
+    return arr
+
+# Raw upload format: 22 little-endian float32 values, no header (88 bytes)
+VOICE_RAW_NBYTES = VOICE_NUM_FEATURES * 4
+NPY_MAGIC = b"\x93NUMPY"
+# A 22-value .npy is ~200 bytes; anything past this is refused with 413
+MAX_VOICE_BYTES = 64 * 1024
+
+def may_be_raw_voice_upload(file: UploadFile) -> bool:
+    return file.content_type == "application/octet-stream" and file.size == VOICE_RAW_NBYTES
+
+def preprocess_voice_from_raw_bytes(raw: bytes) -> np.ndarray:
+    """Zero-copy (1,22) float32 view over a raw 88-byte feature upload."""
+    return _require_finite(np.frombuffer(raw, dtype="<f4").reshape(1, VOICE_NUM_FEATURES))
+
+_NPY_HEADER_READERS = {
+    (1, 0): np.lib.format.read_array_header_1_0,
+    (2, 0): np.lib.format.read_array_header_2_0,
+}
+
+def preprocess_voice_from_npy(source) -> np.ndarray:
+    """
+    Parse a .npy upload, given as bytes or read directly from a file object.
+    Only the header is parsed before the shape/dtype checks; the data
+    itself is read just for a valid 22-value array.
+    """
+    if isinstance(source, (bytes, bytearray)):
+        source = io.BytesIO(source)
     try:
-        arr = np.load(io.BytesIO(npy_bytes), allow_pickle=False)
+        version = np.lib.format.read_magic(source)
+        if version not in _NPY_HEADER_READERS:
+            raise ValueError(f"unsupported .npy format version {version}")
+        shape, fortran_order, dtype = _NPY_HEADER_READERS[version](source)
     except Exception as e:
         raise ValueError(f"Could not load .npy: {e}")
 
-    arr = np.array(arr).astype(np.float32)
+    # Validate size and dtype before reading/converting anything
+    n = int(np.prod(shape))
+    if n != VOICE_NUM_FEATURES:
+        raise _feature_count_error(n)
+    if dtype.kind not in "iuf":
+        raise ValueError(f"Features must be numeric, got dtype {dtype}")
 
-    if arr.ndim == 1:
-        arr = arr.reshape(1, -1)
-    elif arr.ndim == 2 and arr.shape[0] != 1:
-        arr = arr.reshape(1, -1)
+    data = source.read(n * dtype.itemsize)
+    if len(data) != n * dtype.itemsize:
+        raise ValueError("Could not load .npy: file is truncated")
+    arr = np.frombuffer(data, dtype=dtype).reshape(shape, order="F" if fortran_order else "C")
 
-    return arr
+    # Only convert when the dtype differs (e.g. float64 or big-endian)
+    if arr.dtype != np.float32:
+        with np.errstate(over="ignore", invalid="ignore"):   # overflow -> inf, rejected below
+            arr = arr.astype(np.float32)
+    return _require_finite(arr.reshape(1, VOICE_NUM_FEATURES))
 
 def preprocess_voice_from_list(features: List[float]) -> np.ndarray:
-    return np.array(features, dtype=np.float32).reshape(1, -1)
+    """
+    Validate the feature count first, then build the (1,22) float32 array.
+    A fresh array per request (no shared buffer): inputs wait in the batch
+    queue and are used as cache keys after this returns.
+    """
+    if not isinstance(features, (list, tuple)):
+        raise ValueError("Features must be a list of numbers")
+    if len(features) == 1 and isinstance(features[0], (list, tuple)):
+        features = features[0]   # accept [[f1, ..., f22]]
+    if len(features) != VOICE_NUM_FEATURES:
+        raise _feature_count_error(len(features))
+
+    try:
+        with np.errstate(over="ignore"):   # overflow -> inf, rejected below
+            arr = np.asarray(features, dtype=np.float32).reshape(1, VOICE_NUM_FEATURES)
+    except (TypeError, ValueError) as e:
+        raise ValueError(f"Features must be numeric: {e}")
+    return _require_finite(arr)
+
+# -------------------------
+# UPLOADS
+# -------------------------
+async def read_upload_capped(file: UploadFile, max_bytes: int) -> bytes:
+    """
+    Read at most max_bytes + 1 straight from the upload's spooled file (on
+    the preprocessing pool, it may be on disk), failing with 413 if more.
+    """
+    data = await run_preprocess(file.file.read, max_bytes + 1)
+    if len(data) > max_bytes:
+        raise HTTPException(
+            status_code=413,
+            detail=f"File too large. Maximum upload size is {max_bytes // (1024 * 1024)} MB"
+        )
+    return data
+
+async def read_voice_input(request: Request, file: Optional[UploadFile]) -> np.ndarray:
+    """
+    Parse the (1,22) feature array from a file upload or the JSON body.
+    Raises ValueError for malformed input, HTTPException for missing input.
+    """
+    # If uploaded file (raw float32 or .npy)
+    if file is not None:
+        logger.info(f"Reading voice features from file: {file.filename}")
+        if file.size is not None and file.size > MAX_VOICE_BYTES:
+            raise HTTPException(
+                status_code=413,
+                detail=f"File too large. Maximum voice upload size is {MAX_VOICE_BYTES // 1024} KB"
+            )
+        if may_be_raw_voice_upload(file):
+            file_bytes = await file.read()
+            if file_bytes.startswith(NPY_MAGIC):   # a (tiny) real .npy file
+                return preprocess_voice_from_npy(file_bytes)
+            else:
+                return preprocess_voice_from_raw_bytes(file_bytes)
+        else:
+            # Parse straight from the spooled upload, no intermediate bytes
+            return await run_preprocess(preprocess_voice_from_npy, file.file)
+    else:
+        # Try to read JSON body
+        try:
+            body = await request.json()
+        except Exception as e:
+            raise HTTPException(
+                400,
+                detail="No input provided. Send either JSON body {'features': [...]} or upload .npy file"
+            )
+
+        if "features" in body:
+            return preprocess_voice_from_list(body["features"])
+        elif isinstance(body, list):
+            return preprocess_voice_from_list(body)
+        else:
+            raise HTTPException(
+                400,
+                detail="Invalid JSON format. Expected {'features': [22 values]} or direct array"
+            )
 
 # -------------------------
 # ROUTES
 # -------------------------
 @app.get("/")
 async def root():
-    """Health check endpoint - returns immediately without loading models."""
+    """Health check endpoint - returns immediately."""
     return {
         "status": "ok",
         "service": "Parkinsons ML Server",
@@ -167,31 +1176,46 @@ async def root():
         "endpoints": {
             "mri": "/predict/mri",
             "voice": "/predict/voice",
-            "health": "/health"
+            "health": "/health",
+            "cache_clear": "/cache/clear"
         }
     }
 
+@app.post("/cache/clear")
+async def clear_cache():
+    """Drop all cached predictions held by this worker."""
+    with _cache_lock:
+        cleared = len(_mri_cache) + len(_voice_cache)
+        _mri_cache.clear()
+        _voice_cache.clear()
+    logger.info(f"Prediction cache cleared ({cleared} entries)")
+    return {"status": "ok", "cleared": cleared}
+
 @app.get("/health")
 async def health_check():
-    """Detailed health check - loads models to verify they're accessible."""
+    """Detailed health check - reports which models are loaded, and from where."""
     try:
-        mri_loaded = os.path.exists(MRI_MODEL_PATH)
-        voice_loaded = os.path.exists(VOICE_MODEL_PATH)
+        mri_loaded = mri_model is not None
+        voice_loaded = voice_model is not None
         
         return {
             "status": "healthy" if (mri_loaded and voice_loaded) else "degraded",
             "models": {
-                "mri": "available" if mri_loaded else "missing",
-                "voice": "available" if voice_loaded else "missing"
+                "mri": "loaded" if mri_loaded else "not loaded",
+                "voice": "loaded" if voice_loaded else "not loaded"
+            },
+            "backends": {
+                "mri": _mri_source[0] if mri_loaded else None,
+                "voice": _voice_source[0] if voice_loaded else None
             },
             "model_paths": {
-                "mri": MRI_MODEL_PATH,
-                "voice": VOICE_MODEL_PATH
+                "mri": _mri_source[1] if mri_loaded else MRI_MODEL_PATH,
+                "voice": _voice_source[1] if voice_loaded else VOICE_MODEL_PATH
             }
         }
     except Exception as e:
         logger.error(f"Health check failed: {e}")
-        return JSONResponse(
+        return ORJSONResponse(
             status_code=500,
             content={"status": "unhealthy", "error": str(e)}
         )
@@ -205,8 +1229,8 @@ async def predict_mri(file: UploadFile = File(...)):
     Expects: form-data with key 'file' containing an image (PNG, JPEG, etc.)
     Returns: prediction label and confidence score
     """
-    # Load model on first request
-    model = load_mri_model()
+    if mri_model is None:
+        raise HTTPException(status_code=503, detail="MRI model not loaded")
     
     # Validate file upload
     if not file:
@@ -220,16 +1244,29 @@ async def predict_mri(file: UploadFile = File(...)):
     
     logger.info(f"Processing MRI image: {file.filename}, type: {file.content_type}")
 
+    start_time = time.time()
+    bytes_data = await read_upload_capped(file, MAX_MRI_BYTES)
+
     try:
-        start_time = time.time()
-        bytes_data = await file.read()
-        x = preprocess_mri_from_bytes(bytes_data)
+        key = cache_key(bytes_data)
+        cached = cache_get(_mri_cache, key)
+        if cached is not None:
+            label, prob = cached
+        else:
+            preprocess = preprocess_mri_in_graph if _mri_decode_graph is not None else preprocess_mri_from_bytes
+            try:
+                x = await run_preprocess(preprocess, bytes_data)
+            except ValueError as ve:
+                logger.error(f"MRI preprocessing error: {ve}")
+                raise HTTPException(status_code=400, detail=f"Image processing failed: {ve}")
 
-        preds = model.predict(x)
-        prob = float(preds.ravel()[0])
-        prob = float(np.clip(prob, 0, 1))
+            preds = await mri_batcher.process_batched(x)
+            # Plain scalar clamp to [0, 1]; np.clip would allocate a 0-d array
+            raw = float(preds.item() if preds.size == 1 else preds.ravel()[0])
+            prob = 0.0 if raw < 0.0 else (1.0 if raw > 1.0 else raw)
 
-        label = "parkinsons" if prob > 0.5 else "normal"
+            label = "parkinsons" if prob > 0.5 else "normal"
+            cache_put(_mri_cache, key, (label, prob))
         
         inference_time = time.time() - start_time
         logger.info(f"MRI prediction complete: {label} ({prob:.4f}) in {inference_time:.3f}s")
@@ -240,9 +1277,8 @@ async def predict_mri(file: UploadFile = File(...)):
             "inference_time_seconds": round(inference_time, 3)
         }
 
-    except ValueError as ve:
-        logger.error(f"MRI preprocessing error: {ve}")
-        raise HTTPException(status_code=400, detail=f"Image processing failed: {ve}")
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"MRI prediction failed: {e}")
         raise HTTPException(status_code=500, detail=f"MRI prediction failed: {e}")
@@ -256,61 +1292,49 @@ async def predict_voice(request: Request, file: Optional[UploadFile] = File(None
     Accepts either:
     1. JSON body: {"features": [22 float values]}
     2. File upload (.npy format)
+    3. File upload of 22 raw little-endian float32 values (88 bytes,
+       content type application/octet-stream) - fastest path
     
     Returns: prediction label, confidence, and probability distribution
     """
-    # Load model on first request
-    model = load_voice_model()
+    if voice_model is None:
+        raise HTTPException(status_code=503, detail="Voice model not loaded")
     
     logger.info(f"Processing voice prediction request")
 
     try:
         start_time = time.time()
         
-        # If uploaded file (.npy)
-        if file is not None:
-            logger.info(f"Reading voice features from file: {file.filename}")
-            arr = preprocess_voice_from_npy_bytes(await file.read())
-        else:
-            # Try to read JSON body
-            try:
-                body = await request.json()
-            except Exception as e:
-                raise HTTPException(
-                    400,
-                    detail="No input provided. Send either JSON body {'features': [...]} or upload .npy file"
-                )
-            
-            if "features" in body:
-                arr = preprocess_voice_from_list(body["features"])
-            elif isinstance(body, list):
-                arr = preprocess_voice_from_list(body)
-            else:
-                raise HTTPException(
-                    400,
-                    detail="Invalid JSON format. Expected {'features': [22 values]} or direct array"
-                )
-
-        # Check feature count (voice model expects 22 features)
-        if arr.shape[1] != 22:
-            raise HTTPException(
-                400,
-                detail=f"Expected 22 features, got {arr.shape[1]}. Please provide all required voice measurements."
-            )
-
-        pred = int(model.predict(arr)[0])
-        label = VOICE_LABELS.get(pred, str(pred))
+        # Only bad input is the client's fault (400): inference errors
+        # further down fall through to the 500 below
+        try:
+            arr = await read_voice_input(request, file)
+        except ValueError as ve:
+            logger.error(f"Voice input error: {ve}")
+            raise HTTPException(400, detail=str(ve))
 
-        # probability
-        prob_dict = {}
-        if _voice_has_proba:
-            probs = model.predict_proba(arr)[0]
-            for cls, p in zip(model.classes_, probs):
-                prob_dict[VOICE_LABELS[int(cls)]] = float(p)
-            confidence = float(max(probs))
+        key = arr.tobytes()
+        cached = cache_get(_voice_cache, key)
+        if cached is not None:
+            label, confidence, prob_dict = cached
+            prob_dict = dict(prob_dict)
         else:
-            prob_dict[label] = 1.0
-            confidence = 1.0
+            out = await voice_batcher.process_batched(arr)
+
+            # probability
+            if _voice_has_proba:
+                # Label straight from the probabilities, no second SVC pass
+                probs = out
+                idx = int(probs.argmax())
+                label = _VOICE_CLASS_NAMES[idx]
+                confidence = float(probs[idx])
+                prob_dict = dict(zip(_VOICE_CLASS_NAMES, probs.tolist()))
+            else:
+                pred = out.item() if isinstance(out, np.generic) else out
+                label = VOICE_LABELS.get(pred, str(pred))
+                prob_dict = {label: 1.0}
+                confidence = 1.0
+            cache_put(_voice_cache, key, (label, confidence, dict(prob_dict)))
         
         inference_time = time.time() - start_time
         logger.info(f"Voice prediction complete: {label} ({confidence:.4f}) in {inference_time:.3f}s")
@@ -328,9 +1352,40 @@ async def predict_voice(request: Request, file: Optional[UploadFile] = File(None
         logger.error(f"Voice prediction failed: {e}")
         raise HTTPException(500, f"Voice prediction failed: {e}")
 
+# -------------------------
+# PRELOAD (gunicorn --preload)
+# -------------------------
+# Load the (scikit-learn / .npz) voice model in the gunicorn master so forked
+# workers share its arrays copy-on-write. ONNX Runtime sessions and the MRI
+# model are loaded per worker at startup: TF/ORT thread pools do not
+# survive fork(). A failure here must not stop the master from starting:
+# each worker's load_models() retries and answers 503 if it fails again.
+if os.environ.get("PRELOAD_MODELS") == "1" and _voice_backend()[0] in ("sklearn", "npz"):
+    try:
+        load_voice_model()
+    except Exception as e:
+        logger.error(f"Voice model preload failed, workers will retry: {e}")
+
 # -------------------------
 # MAIN (for local dev)
 # -------------------------
+# Production runs under gunicorn (see gunicorn.conf.py), which preloads the
+# app in the master before forking the workers:
+#   gunicorn -c gunicorn.conf.py app:app
+# `python app.py` starts WORKERS uvicorn processes on uvloop + httptools
+# (both come with uvicorn[standard]); DEBUG=true gives a single
+# auto-reloading process instead.
 if __name__ == "__main__":
+    import sys
     import uvicorn
-    uvicorn.run("app:app", host="0.0.0.0", port=8000, reload=True)
+
+    debug = os.environ.get("DEBUG", "").lower() in ("1", "true")
+    uvicorn.run(
+        "app:app",
+        host=os.environ.get("HOST", "0.0.0.0"),
+        port=int(os.environ.get("PORT", "8000")),
+        workers=1 if debug else int(os.environ.get("WORKERS", max(1, (os.cpu_count() or 2) // 2))),
+        loop="asyncio" if sys.platform == "win32" else "uvloop",   # no uvloop on Windows
+        http="httptools",
+        reload=debug,
+    )
@@ -0,0 +1,338 @@
+# export_models.py
+"""
+One-off conversion of the trained models into faster serving formats.
+
+Run from the ml-server folder:
+
+    python export_models.py mri-fuse-norm
+    python export_models.py mri-onnx
+    python export_models.py mri-savedmodel
+    python export_models.py mri-int8 --calib-dir path/to/mri_images
+    python export_models.py mri-tflite --calib-dir path/to/mri_images
+    python export_models.py voice-onnx
+    python export_models.py voice-npz
+
+Commands:
+ - mri-fuse-norm : prepend the (pixel - 40.60) / 57.22 normalization as a
+              Rescaling layer -> models/model_bestmri_fused.h5 (only for
+              models that don't already normalize internally)
+ - mri-onnx : export models/model_bestmri.h5 -> models/mri.onnx (tf2onnx)
+ - mri-savedmodel : export the Keras model as a SavedModel with a
+              (None,128,128,3) serving signature -> models/mri_saved/
+ - mri-int8 : statically quantize models/mri.onnx -> models/mri_int8.onnx,
+              calibrated on ~100 sample MRI images
+ - mri-tflite : full-integer (INT8, uint8 input) TFLite conversion of the
+              Keras model -> models/mri_int8.tflite, same calibration
+ - voice-onnx : export models/voice_model.joblib -> models/voice_model.onnx
+              (skl2onnx, probabilities as a plain tensor, classes in metadata)
+ - voice-npz : save the arrays of a binary RBF SVC (with or without
+              probability=True) -> models/voice_model.npz
+              (loaded without unpickling sklearn, predicted with numba/numpy)
+
+app.py picks up the exported files automatically when they exist.
+"""
+
+import os
+import sys
+import json
+import argparse
+
+import numpy as np
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+MODEL_DIR = os.path.join(BASE_DIR, "models")
+MRI_MODEL_PATH = os.path.join(MODEL_DIR, "model_bestmri.h5")
+MRI_FUSED_PATH = os.path.join(MODEL_DIR, "model_bestmri_fused.h5")
+MRI_ONNX_PATH = os.path.join(MODEL_DIR, "mri.onnx")
+MRI_ONNX_INT8_PATH = os.path.join(MODEL_DIR, "mri_int8.onnx")
+MRI_TFLITE_PATH = os.path.join(MODEL_DIR, "mri_int8.tflite")
+MRI_SAVEDMODEL_DIR = os.path.join(MODEL_DIR, "mri_saved")
+VOICE_MODEL_PATH = os.path.join(MODEL_DIR, "voice_model.joblib")
+VOICE_ONNX_PATH = os.path.join(MODEL_DIR, "voice_model.onnx")
+VOICE_NPZ_PATH = os.path.join(MODEL_DIR, "voice_model.npz")
+
+IMG_SIZE = (128, 128)
+VOICE_NUM_FEATURES = 22
+
+# Dataset statistics used by the training-time normalization
+MRI_MEAN = 40.60
+MRI_STD = 57.22
+
+
+def _has_internal_normalization(model):
+    """True if the model already contains a Rescaling/Normalization layer."""
+    return any(
+        'Rescaling' in type(layer).__name__ or 'Normalization' in type(layer).__name__
+        for layer in model.layers
+    )
+
+
+def export_mri_fused_norm(args):
+    """Fold the MRI normalization into the graph so the server feeds raw pixels."""
+    import tensorflow as tf
+    from tensorflow import keras
+
+    print(f"Loading Keras model from: {args.model}")
+    model = keras.models.load_model(args.model)
+
+    if _has_internal_normalization(model) and not args.force:
+        print("ℹ️  Model already normalizes its input internally - nothing to fuse.")
+        print("   (app.py feeds raw pixels; use --force only if that layer is unrelated)")
+        return
+
+    inputs = keras.Input((IMG_SIZE[0], IMG_SIZE[1], 3), dtype=tf.float32)
+    x = keras.layers.Rescaling(1.0 / MRI_STD, offset=-MRI_MEAN / MRI_STD)(inputs)
+    fused = keras.Model(inputs, model(x))
+    fused.save(args.output)
+    print(f"✅ Saved fused model to: {args.output}")
+
+
+def export_mri_onnx(args):
+    """Convert the Keras MRI model to an ONNX graph with a dynamic batch axis."""
+    import tensorflow as tf
+    import tf2onnx
+
+    print(f"Loading Keras model from: {args.model}")
+    model = tf.keras.models.load_model(args.model)
+
+    spec = [tf.TensorSpec([None, IMG_SIZE[0], IMG_SIZE[1], 3], tf.float32, name="input")]
+    tf2onnx.convert.from_keras(model, input_signature=spec, opset=args.opset, output_path=args.output)
+    print(f"✅ Saved ONNX model to: {args.output}")
+
+
+def export_mri_savedmodel(args):
+    """Re-export the Keras MRI model as a SavedModel with a fixed serving signature."""
+    import tensorflow as tf
+
+    print(f"Loading Keras model from: {args.model}")
+    model = tf.keras.models.load_model(args.model)
+
+    @tf.function(input_signature=[tf.TensorSpec([None, IMG_SIZE[0], IMG_SIZE[1], 3], tf.float32, name="input")])
+    def serve(x):
+        return {"output_0": model(x, training=False)}
+
+    tf.saved_model.save(model, args.output, signatures={"serving_default": serve.get_concrete_function()})
+    print(f"✅ Saved SavedModel to: {args.output}")
+
+
+def _load_calibration_images(calib_dir, limit):
+    """Preprocess up to `limit` images exactly like the /predict/mri endpoint."""
+    from app import preprocess_mri_from_bytes
+
+    images = []
+    for name in sorted(os.listdir(calib_dir)):
+        if len(images) >= limit:
+            break
+        path = os.path.join(calib_dir, name)
+        if not os.path.isfile(path):
+            continue
+        with open(path, "rb") as f:
+            try:
+                x = preprocess_mri_from_bytes(f.read())
+            except ValueError:
+                print(f"  skipping unreadable image: {name}")
+                continue
+        images.append(np.asarray(x, dtype=np.float32).reshape(1, IMG_SIZE[0], IMG_SIZE[1], 3))
+    return images
+
+
+def export_mri_int8(args):
+    """Post-training static INT8 quantization (QDQ, per-channel) of the ONNX MRI model."""
+    import onnxruntime as ort
+    from onnxruntime.quantization import (
+        CalibrationDataReader, QuantFormat, QuantType, quantize_static
+    )
+
+    if not os.path.exists(args.model):
+        raise FileNotFoundError(f"{args.model} not found, run 'mri-onnx' first")
+
+    images = _load_calibration_images(args.calib_dir, args.limit)
+    if not images:
+        raise ValueError(f"No calibration images found in {args.calib_dir}")
+    print(f"Calibrating on {len(images)} images from: {args.calib_dir}")
+
+    input_name = ort.InferenceSession(args.model, providers=["CPUExecutionProvider"]).get_inputs()[0].name
+
+    class CalibReader(CalibrationDataReader):
+        def __init__(self, samples):
+            self._it = iter(samples)
+
+        def get_next(self):
+            x = next(self._it, None)
+            return None if x is None else {input_name: x}
+
+    quantize_static(
+        model_input=args.model,
+        model_output=args.output,
+        calibration_data_reader=CalibReader(images),
+        quant_format=QuantFormat.QDQ,
+        per_channel=True,
+        activation_type=QuantType.QInt8,
+        weight_type=QuantType.QInt8,
+    )
+    print(f"✅ Saved INT8 model to: {args.output}")
+    print("   Compare predictions against mri.onnx on held-out scans before deploying.")
+
+
+def export_mri_tflite(args):
+    """Post-training full-integer quantization of the Keras MRI model to TFLite."""
+    import tensorflow as tf
+
+    images = _load_calibration_images(args.calib_dir, args.limit)
+    if not images:
+        raise ValueError(f"No calibration images found in {args.calib_dir}")
+    print(f"Calibrating on {len(images)} images from: {args.calib_dir}")
+
+    print(f"Loading Keras model from: {args.model}")
+    model = tf.keras.models.load_model(args.model)
+
+    def representative_dataset():
+        for x in images:
+            yield [x]
+
+    converter = tf.lite.TFLiteConverter.from_keras_model(model)
+    converter.optimizations = [tf.lite.Optimize.DEFAULT]
+    converter.representative_dataset = representative_dataset
+    converter.target_spec.supported_ops = [tf.lite.OpsSet.TFLITE_BUILTINS_INT8]
+    converter.inference_input_type = tf.uint8
+
+    with open(args.output, "wb") as f:
+        f.write(converter.convert())
+    print(f"✅ Saved INT8 TFLite model to: {args.output}")
+    print("   Compare predictions against the Keras model on held-out scans before deploying.")
+
+
+def export_voice_onnx(args):
+    """Convert the scikit-learn voice SVC to ONNX, writing it only if it matches sklearn."""
+    import joblib
+    import onnxruntime as ort
+    from skl2onnx import convert_sklearn
+    from skl2onnx.common.data_types import FloatTensorType
+
+    print(f"Loading voice model from: {args.model}")
+    model = joblib.load(args.model)
+
+    # Without probability=True, skl2onnx's second output holds decision
+    # scores, not probabilities - refuse rather than serve those as such
+    if not hasattr(model, "predict_proba"):
+        raise ValueError(
+            f"{type(model).__name__} has no predict_proba (trained with probability=False?), "
+            "keep serving the joblib model"
+        )
+
+    onx = convert_sklearn(
+        model,
+        initial_types=[("X", FloatTensorType([None, VOICE_NUM_FEATURES]))],
+        options={id(model): {"zipmap": False}},
+    )
+    # app.py maps probability columns to labels with these
+    meta = onx.metadata_props.add()
+    meta.key = "classes"
+    meta.value = json.dumps(model.classes_.tolist())
+    meta = onx.metadata_props.add()
+    meta.key = "probabilities"
+    meta.value = "1"
+    data = onx.SerializeToString()
+
+    # Sanity check on the support vectors (real, in-distribution samples)
+    # before anything is written: app.py picks the file up automatically
+    sample = np.asarray(getattr(model, "support_vectors_", np.zeros((1, VOICE_NUM_FEATURES))), dtype=np.float32)
+    session = ort.InferenceSession(data, providers=["CPUExecutionProvider"])
+    onnx_labels, onnx_probs = session.run(None, {"X": sample})
+    label_mismatches = int((np.asarray(onnx_labels) != model.predict(sample)).sum())
+    diff = float(np.abs(onnx_probs - model.predict_proba(sample)).max())
+    print(f"   Label mismatches vs scikit-learn: {label_mismatches}/{len(sample)}")
+    print(f"   Max probability difference vs scikit-learn: {diff:.2e}")
+    if label_mismatches or diff > 1e-3:
+        raise ValueError("ONNX model disagrees with scikit-learn, nothing written")
+
+    with open(args.output, "wb") as f:
+        f.write(data)
+    print(f"✅ Saved ONNX model to: {args.output}")
+
+
+def export_voice_npz(args):
+    """Save the voice SVC as plain arrays, writing them only if the app's predictor matches sklearn."""
+    import io
+    import joblib
+    from app import SVC_KERNEL_TOLERANCE, _load_voice_npz, _svc_rbf_error, _svc_rbf_params
+
+    print(f"Loading voice model from: {args.model}")
+    model = joblib.load(args.model)
+
+    params = _svc_rbf_params(model)
+    if params is None:
+        raise ValueError(f"{type(model).__name__} is not a binary RBF SVC, use 'voice-onnx' instead")
+    buf = io.BytesIO()
+    np.savez(buf, **params)
+
+    # Round trip through the loader the server uses
+    buf.seek(0)
+    loaded, infer, _ = _load_voice_npz(buf)
+    sample = np.asarray(params["sv"], dtype=np.float32)
+    err = _svc_rbf_error(model, loaded, infer, sample)
+    kind = "probability" if "prob_a" in params else "decision value"
+    print(f"   Max {kind} difference vs scikit-learn: {err:.2e}")
+    if err > SVC_KERNEL_TOLERANCE:
+        raise ValueError("exported predictor disagrees with scikit-learn, nothing written")
+
+    with open(args.output, "wb") as f:
+        f.write(buf.getvalue())
+    print(f"✅ Saved voice arrays to: {args.output}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export models to serving formats")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p = sub.add_parser("mri-fuse-norm", help="Prepend the MRI normalization as a Rescaling layer")
+    p.add_argument("--model", default=MRI_MODEL_PATH)
+    p.add_argument("--output", default=MRI_FUSED_PATH)
+    p.add_argument("--force", action="store_true", help="Fuse even if a normalization layer exists")
+    p.set_defaults(func=export_mri_fused_norm)
+
+    p = sub.add_parser("mri-onnx", help="Export the MRI Keras model to ONNX")
+    p.add_argument("--model", default=MRI_FUSED_PATH if os.path.exists(MRI_FUSED_PATH) else MRI_MODEL_PATH)
+    p.add_argument("--output", default=MRI_ONNX_PATH)
+    p.add_argument("--opset", type=int, default=17)
+    p.set_defaults(func=export_mri_onnx)
+
+    p = sub.add_parser("mri-savedmodel", help="Export the MRI Keras model as a SavedModel")
+    p.add_argument("--model", default=MRI_FUSED_PATH if os.path.exists(MRI_FUSED_PATH) else MRI_MODEL_PATH)
+    p.add_argument("--output", default=MRI_SAVEDMODEL_DIR)
+    p.set_defaults(func=export_mri_savedmodel)
+
+    p = sub.add_parser("mri-int8", help="INT8-quantize the exported MRI ONNX model")
+    p.add_argument("--calib-dir", required=True, help="Folder of sample MRI images")
+    p.add_argument("--limit", type=int, default=100)
+    p.add_argument("--model", default=MRI_ONNX_PATH)
+    p.add_argument("--output", default=MRI_ONNX_INT8_PATH)
+    p.set_defaults(func=export_mri_int8)
+
+    p = sub.add_parser("mri-tflite", help="INT8-quantize the MRI Keras model to TFLite")
+    p.add_argument("--calib-dir", required=True, help="Folder of sample MRI images")
+    p.add_argument("--limit", type=int, default=100)
+    p.add_argument("--model", default=MRI_FUSED_PATH if os.path.exists(MRI_FUSED_PATH) else MRI_MODEL_PATH)
+    p.add_argument("--output", default=MRI_TFLITE_PATH)
+    p.set_defaults(func=export_mri_tflite)
+
+    p = sub.add_parser("voice-onnx", help="Export the voice SVC to ONNX")
+    p.add_argument("--model", default=VOICE_MODEL_PATH)
+    p.add_argument("--output", default=VOICE_ONNX_PATH)
+    p.set_defaults(func=export_voice_onnx)
+
+    p = sub.add_parser("voice-npz", help="Export the voice SVC arrays to .npz")
+    p.add_argument("--model", default=VOICE_MODEL_PATH)
+    p.add_argument("--output", default=VOICE_NPZ_PATH)
+    p.set_defaults(func=export_voice_npz)
+
+    args = parser.parse_args()
+    try:
+        args.func(args)
+    except Exception as e:
+        print(f"❌ Export failed: {e}")
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
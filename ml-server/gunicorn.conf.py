@@ -0,0 +1,31 @@
+# gunicorn.conf.py
+"""
+Production launch with several Uvicorn workers:
+
+    gunicorn -c gunicorn.conf.py app:app
+
+Each worker owns its own copy of the models, so requests are served in
+parallel instead of queuing behind a single Python process. The app is
+preloaded in the master (PRELOAD_MODELS=1) before the workers are forked.
+
+Every worker loads TensorFlow and the MRI model itself (several hundred MB
+each), so the default is a fixed 2 workers rather than one per CPU:
+cpu_count() reports the host's cores inside containers and would OOM a
+small PaaS instance. Scale with WORKERS (or the platform's WEB_CONCURRENCY)
+up to the cores and memory actually available.
+"""
+
+import os
+
+# One math thread per worker: scale by adding workers, extra
+# TF/BLAS/OpenMP threads per worker would only fight over the cores.
+for var in ("OMP_NUM_THREADS", "TF_NUM_INTRAOP_THREADS", "TF_NUM_INTEROP_THREADS"):
+    os.environ.setdefault(var, "1")
+os.environ.setdefault("PRELOAD_MODELS", "1")
+
+bind = f"0.0.0.0:{os.environ.get('PORT', '8000')}"
+workers = int(os.environ.get("WORKERS", os.environ.get("WEB_CONCURRENCY", "2")))
+worker_class = "uvicorn.workers.UvicornWorker"
+preload_app = True
+timeout = int(os.environ.get("PREDICTION_TIMEOUT_SECONDS", "120"))
+loglevel = os.environ.get("LOG_LEVEL", "info")